@@ -31,6 +31,19 @@ class SessionCallback:
     def on_update(self):
         """Take action when the session outputs are being updated."""
 
+    def __setattr__(self, name, value):
+        """Set an attribute, letting the session know if `on_update` changed.
+
+        Sessions only call `on_update` for callbacks that implement it, which
+        they check when the callback is added or `on_update` is assigned.
+
+        """
+        super().__setattr__(name, value)
+        if name == "on_update":
+            session = getattr(self, "session", None)
+            if session is not None:
+                session._refresh_update_callbacks()
+
 
 class LambdaSessionCallback(SessionCallback):
     """Create a session callback with lambda functions.
@@ -56,3 +69,10 @@ class LambdaSessionCallback(SessionCallback):
         if on_update:
             self.on_update = on_update
         super().__init__()
+
+
+def _overrides(callback, event):
+    """Check whether `callback` implements `event` rather than the no-op stub."""
+    if event in vars(callback):
+        return True
+    return getattr(type(callback), event) is not getattr(SessionCallback, event)
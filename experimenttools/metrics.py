@@ -4,7 +4,7 @@ Metrics can be created and then their current value can be updated by calling
 them. Additionally, they can register callbacks to call every time the current
 value is updated. Certain types of metrics can also be plotted and serialized.
 Metric management can be automated using `Session` and `SessionManager`
-objects.
+objects. `holoviews` is only imported once a metric is plotted.
 
 Examples
 --------
@@ -18,16 +18,56 @@ Examples
 3
 >>> m.values
 [2, 3]
+>>> m.extend([4, 5])
+>>> m.values
+[2, 3, 4, 5]
 >>> import holoviews as hv
 >>> import tempfile
 >>> f = tempfile.NamedTemporaryFile(suffix=".html")
 >>> hv.save(m.plot(), f.name)
 
 """
+import csv
+import io
+from array import array
+from itertools import repeat
+from time import monotonic_ns
 from time import time as curr_time
 
-import holoviews as hv
-import pandas as pd
+_hv = None
+
+
+def _import_holoviews():
+    """Import `holoviews` and load the bokeh extension on first use.
+
+    `holoviews` is only installed with the `plot` extra.
+
+    """
+    global _hv
+    if _hv is None:
+        try:
+            import holoviews as hv
+        except ImportError as e:
+            raise ImportError(
+                "Plotting requires holoviews, install it with "
+                "'pip install experimenttools[plot]'"
+            ) from e
+        hv.extension("bokeh")
+        _hv = hv
+    return _hv
+
+
+def _write_all(file, data):
+    """Write all of `data` to an unbuffered binary file.
+
+    Raw file writes may write fewer bytes than requested, so this keeps
+    writing the remainder until everything has been written.
+
+    """
+    view = memoryview(data)
+    written = 0
+    while written < len(view):
+        written += file.write(view[written:])
 
 
 class Metric:
@@ -60,24 +100,48 @@ class Metric:
         """
         self.name = name
         self._callbacks = []
+        self._dispatch = self._dispatch_none
+        # Incremented on every update so consumers can detect changes cheaply
+        self._version = 0
         if callbacks:
             for callback in callbacks:
                 self.add_callback(callback)
         if initial_value is not None:
             self(initial_value)
 
-    def __call__(self, *args, **kwargs):
+    def __call__(self, value=None):
         """Run all callbacks after updating metric."""
-        for callback in self._callbacks:
-            callback(self)
+        self._version += 1
+        self._dispatch()
 
     def add_callback(self, callback):
         """Add a new callback."""
         self._callbacks.append(callback)
+        self._update_dispatch()
 
     def remove_callback(self, callback):
         """Remove a callback."""
         self._callbacks.remove(callback)
+        self._update_dispatch()
+
+    def _update_dispatch(self):
+        # Specialize the callback dispatch for the common small cases
+        if not self._callbacks:
+            self._dispatch = self._dispatch_none
+        elif len(self._callbacks) == 1:
+            self._dispatch = self._dispatch_one
+        else:
+            self._dispatch = self._dispatch_all
+
+    def _dispatch_none(self):
+        pass
+
+    def _dispatch_one(self):
+        self._callbacks[0](self)
+
+    def _dispatch_all(self):
+        for callback in self._callbacks:
+            callback(self)
 
 
 class SerializableMetric(Metric):
@@ -88,7 +152,12 @@ class SerializableMetric(Metric):
     used in a `Session`, the `file` argument will be the same every time
     the method is called, so the subclass can choose to append to the
     file instead of rewriting every time. Additionally, the subclass is
-    responsible for appending the correct suffix to `file`.
+    responsible for appending the correct suffix to `file`. Subclasses
+    that keep the file open between calls should release it in `close`.
+
+    Subclasses may also implement `serialize_bytes(self)`, which returns the
+    serialized progress made since the previous call instead of writing it.
+    It is used by sessions that aggregate all metrics into a single file.
 
     """
 
@@ -96,6 +165,13 @@ class SerializableMetric(Metric):
         """Write metric history to a file."""
         raise NotImplementedError
 
+    def serialize_bytes(self):
+        """Get the serialized metric history since the previous call."""
+        raise NotImplementedError
+
+    def close(self):
+        """Release any resources held for serialization."""
+
 
 class PlottableMetric(Metric):
     """Base class for metrics that can be plotted.
@@ -115,50 +191,79 @@ class TimedMetric(Metric):
 
     Each time the metric is called with a new value, the current time
     offset by the time when the metric was first called is added to a
-    list.
+    list. Offsets are measured with a monotonic clock and stored as integer
+    nanoseconds, then converted to seconds when they are read.
 
     """
 
     def __init__(self, *args, **kwargs):
-        self._times = []
+        self._times = array("q")
+        self._start_ns = None
         self._start_time = None
         super().__init__(*args, **kwargs)
 
-    def __call__(self, *args, **kwargs):
+    def __call__(self, value=None):
         """Record the time at which the metric is updated."""
-        self._times.append(self.elapsed_time)
-        super().__call__(*args, **kwargs)
+        now = monotonic_ns()
+        if self._start_ns is None:
+            self._set_start(now)
+        self._times.append(now - self._start_ns)
+        super().__call__(value)
+
+    def _set_start(self, now):
+        self._start_ns = now
+        self._start_time = curr_time()
 
     @property
     def start_time(self):
         """Get the seconds since epoch at which metric was first updated."""
-        if not self._start_time:
-            self._start_time = curr_time()
+        if self._start_ns is None:
+            self._set_start(monotonic_ns())
         return self._start_time
 
     @property
     def elapsed_time(self):
         """Get the seconds since the start time."""
-        return curr_time() - self.start_time
+        if self._start_ns is None:
+            self._set_start(monotonic_ns())
+        return (monotonic_ns() - self._start_ns) / 1e9
 
     @property
     def times(self):
-        """Get the list of times at which the metric was updated."""
-        return self._times
+        """Get the list of times, in seconds, at which the metric was updated."""
+        return [t / 1e9 for t in self._times]
 
 
 class NumericMetric(SerializableMetric, PlottableMetric):
     """Track the change of a numeric metric."""
 
+    _csv_header = "value\n"
+
     def __init__(self, *args, **kwargs):
         self._values = []
         self._serialization_idx = 0
+        self._csv_started = False
+        self._file = None
         super().__init__(*args, **kwargs)
 
-    def __call__(self, value, *args, **kwargs):
+    def __call__(self, value):
         """Update the current metric value with `value`."""
         self._values.append(value)
-        super().__call__(value, *args, **kwargs)
+        super().__call__(value)
+
+    def extend(self, values):
+        """Update the metric with each of `values` in turn.
+
+        Callbacks are run once after all values are added, rather than once
+        per value. Nothing happens if `values` is empty.
+
+        """
+        # Consume `values` first so nothing is added if it raises
+        values = list(values)
+        if values:
+            self._values.extend(values)
+            self._version += 1
+            self._dispatch()
 
     def __iadd__(self, val):
         """Add to the most recent value of a numeric metric."""
@@ -225,6 +330,10 @@ class NumericMetric(SerializableMetric, PlottableMetric):
         self(self.value ^ val)
         return self
 
+    def __len__(self):
+        """Get the number of recorded metric values."""
+        return len(self._values)
+
     @property
     def value(self):
         """Get the current metric value."""
@@ -239,39 +348,121 @@ class NumericMetric(SerializableMetric, PlottableMetric):
         return self._values
 
     def serialize(self, filename):
-        """Write metric history to a file, one line per value."""
-        with open(f"{filename}.csv", "a") as f:
-            if self._serialization_idx == 0:
-                f.write("value\n")
-            for value in self._values[self._serialization_idx :]:
-                f.write(f"{value}\n")
-                self._serialization_idx += 1
+        """Write metric history to a csv file, one line per value."""
+        # Keep the file open between calls and write all new lines at once.
+        # The file is unbuffered so that each call is a single write.
+        if self._file is None:
+            self._file = open(f"{filename}.csv", "ab", buffering=0)
+        elif self._serialization_idx == len(self._values):
+            # Nothing new to write
+            return
+        end = len(self._values)
+        data = self._pending_csv().encode()
+        start = self._file.tell()
+        try:
+            _write_all(self._file, data)
+        except OSError:
+            # Drop any partially written rows, they are written in full by the
+            # next call
+            self._file.truncate(start)
+            raise
+        self._mark_serialized(end)
+
+    def serialize_bytes(self):
+        """Get the csv lines recorded since the last serialization."""
+        end = len(self._values)
+        data = self._pending_csv().encode()
+        self._mark_serialized(end)
+        return data
+
+    def close(self):
+        """Close the serialization file if it is open."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _csv_lines(self, start):
+        return (f"{value}\n" for value in self._values[start:])
+
+    def _pending_csv(self):
+        text = "".join(self._csv_lines(self._serialization_idx))
+        if not self._csv_started:
+            text = self._csv_header + text
+        return text
+
+    def _mark_serialized(self, end):
+        # Only called once the pending lines have been written or handed off
+        self._serialization_idx = end
+        self._csv_started = True
 
     def plot(self):
         """Plot metric history as a line plot."""
+        hv = _import_holoviews()
+        import numpy as np
+
         return hv.Curve(
-            (range(len(self._values)), self._values), "Iteration", self.name
+            (np.arange(len(self._values)), np.asarray(self._values)),
+            "Iteration",
+            self.name,
         )
 
 
 class TimedNumericMetric(NumericMetric, TimedMetric):
-    """Track the change of a numeric metric over time."""
+    """Track the change of a numeric metric over time.
 
-    def serialize(self, filename):
-        """Write metric history to a file as a csv (time,value)."""
-        with open(f"{filename}.csv", "a") as f:
-            if self._serialization_idx == 0:
-                f.write("time,value\n")
-            for time, value in zip(
-                self._times[self._serialization_idx :],
-                self._values[self._serialization_idx :],
-            ):
-                f.write(f"{time},{value}\n")
-                self._serialization_idx += 1
+    Serialized as a csv of `time,value` rows.
+
+    """
+
+    _csv_header = "time,value\n"
+
+    def __call__(self, value):
+        """Update the current metric value with `value` and record the time."""
+        # Equivalent to chaining through the `__call__` of each base class,
+        # flattened since this is called on every update
+        now = monotonic_ns()
+        if self._start_ns is None:
+            self._set_start(now)
+        self._times.append(now - self._start_ns)
+        self._values.append(value)
+        self._version += 1
+        self._dispatch()
+
+    def extend(self, values):
+        """Update the metric with each of `values`, recorded at the same time.
+
+        The clock is read once for the whole batch. Callbacks are run once
+        after all values are added.
+
+        """
+        # Consume `values` first so times and values stay aligned if it raises
+        values = list(values)
+        if not values:
+            return
+        now = monotonic_ns()
+        if self._start_ns is None:
+            self._set_start(now)
+        self._values.extend(values)
+        self._times.extend(repeat(now - self._start_ns, len(values)))
+        self._version += 1
+        self._dispatch()
+
+    def _csv_lines(self, start):
+        return (
+            f"{time / 1e9},{value}\n"
+            for time, value in zip(self._times[start:], self._values[start:])
+        )
 
     def plot(self):
         """Plot metric history as a line plot with seconds as the x-axis."""
-        return hv.Curve((self._times, self._values), "Seconds", self.name)
+        hv = _import_holoviews()
+        import numpy as np
+
+        return hv.Curve(
+            (np.array(self._times) / 1e9, np.asarray(self._values)),
+            "Seconds",
+            self.name,
+        )
 
 
 class ParameterSetMetric(SerializableMetric, PlottableMetric):
@@ -302,25 +493,39 @@ class ParameterSetMetric(SerializableMetric, PlottableMetric):
                 "keyword argument 'initial_value' not valid for 'ParameterSetMetric' "
                 "objects"
             )
-        keys = list(params.keys())
-        values = [str(params[k]) for k in keys]
-        self._params = pd.DataFrame({"parameter": keys, "value": values})
+        self._params = [(key, str(value)) for key, value in params.items()]
         self._serialized = False
         self._plot = None
         super().__init__(name, *args, **kwargs)
 
-    def __call__(self, *args, **kwargs):
+    def __call__(self, value=None):
         """Raise a `TypeError` if called."""
         raise TypeError("'ParameterSetMetric' object is not callable")
 
     def serialize(self, filename):
         """Write parameters to a csv."""
         if not self._serialized:
-            self._params.to_csv(f"{filename}.csv", index=False)
+            with open(f"{filename}.csv", "w", newline="") as f:
+                f.write(self._csv())
             self._serialized = True
 
+    def serialize_bytes(self):
+        """Get the parameters as a csv if they have not been serialized yet."""
+        if self._serialized:
+            return b""
+        self._serialized = True
+        return self._csv().encode()
+
+    def _csv(self):
+        f = io.StringIO()
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(("parameter", "value"))
+        writer.writerows(self._params)
+        return f.getvalue()
+
     def plot(self):
         """Plot parameters as a table."""
-        if not self._plot:
-            self._plot = hv.Table(self._params)
+        if self._plot is None:
+            hv = _import_holoviews()
+            self._plot = hv.Table(self._params, "parameter", "value")
         return self._plot
@@ -6,17 +6,75 @@ serialized together.
 `SessionManager` objects can manage the automatic periodic updating of
 `Session` outputs.
 
+`load_aggregated_metrics` recovers the per-metric serialized output of a
+`Session` created with `aggregate_serialize=True`.
+
 """
+import contextlib
+import html
+import importlib.util
+import json
+import threading
 import time
+import weakref
 from datetime import datetime
 from pathlib import Path
 
-import holoviews as hv
+from experimenttools.callbacks import LambdaSessionCallback, _overrides
+from experimenttools.metrics import (
+    PlottableMetric,
+    SerializableMetric,
+    _import_holoviews,
+    _write_all,
+)
+
+# Page written once by sessions using `live_refresh`. It polls the json file
+# next to it and re-embeds the plots whenever that file changes.
+_LIVE_REFRESH_HTML = """\
+<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+{resources}
+</head>
+<body>
+<div id="experimenttools-plot"></div>
+<script>
+(function() {{
+  var path = window.location.pathname;
+  if (path.endsWith("/")) {{
+    path += "index.html";
+  }}
+  var url = path.replace(/\\.html?$/, "") + ".json";
+  var last = null;
+  function refresh() {{
+    fetch(url, {{cache: "no-store"}})
+      .then(function(response) {{ return response.text(); }})
+      .then(function(text) {{
+        if (!text || text === last) {{
+          return;
+        }}
+        var item = JSON.parse(text);
+        last = text;
+        document.getElementById("experimenttools-plot").innerHTML = "";
+        Bokeh.embed.embed_item(item, "experimenttools-plot");
+      }})
+      .catch(function() {{}});
+  }}
+  refresh();
+  setInterval(refresh, {interval});
+}})();
+</script>
+</body>
+</html>
+"""
+_LIVE_REFRESH_INTERVAL_MS = 5000
 
-from experimenttools.callbacks import LambdaSessionCallback
-from experimenttools.metrics import PlottableMetric, SerializableMetric
 
-hv.extension("bokeh")
+def _index_paths(output_dir):
+    """Get the paths of the plot page and of its `live_refresh` plots."""
+    return output_dir / "index.html", output_dir / "index.json"
 
 
 class Session:
@@ -46,6 +104,9 @@ class Session:
         callbacks=None,
         plot_metrics=True,
         serialize_metrics=True,
+        background_plot=False,
+        aggregate_serialize=False,
+        live_refresh=False,
     ):
         """Create a new experiment session.
 
@@ -60,81 +121,429 @@ class Session:
         callbacks: list of Sessioncallback
                 callbacks to add to the session.
         plot_metrics: bool
-                Whether or not to plots metrics.
+                Whether or not to plot metrics to `index.html`. Requires the
+                `plot` extra. Pass `False` to skip rendering entirely, e.g. in
+                tests that only need the serialized metrics.
         serialize_metrics: bool
                 Whether or not to save metrics to files.
+        background_plot: bool
+                Whether or not to write plots from a background thread when
+                the session is updated. Only the most recent pending plot is
+                written. Use `flush` to wait for pending plots to be written.
+        aggregate_serialize: bool
+                Whether or not to serialize all metrics into a single
+                `metrics.log` file instead of one file per metric. Each chunk
+                appended to the log is recorded as a `name,offset,length` line
+                in `metrics.index.csv`. Use `load_aggregated_metrics` to read
+                the metrics back.
+        live_refresh: bool
+                Whether or not to write `index.html` only once as a page that
+                periodically reloads the plots from `index.json`. Only the
+                json file is rewritten when plotting. The page must be served
+                over HTTP, e.g. with a `SessionServer`, to load the plots.
 
         """
         self.output_dir = Path(output_dir)
         self.name = name
+        self._serialize_dir = self.output_dir / "serialized"
+        self._index_path, self._index_json_path = _index_paths(self.output_dir)
+        # Serialization path of each serializable metric, by name
+        self._serialize_paths = {}
+        self._output_dir_created = False
+        self._serialize_dir_created = False
+        self._aggregate_serialize = aggregate_serialize
+        self._live_refresh = live_refresh
+        self._live_page_written = False
+        self._batch_depth = 0
+        self._update_deferred = False
+        self._log_file = None
+        self._log_index_file = None
+        # Serialized chunks not yet written to the aggregated log
+        self._unwritten_chunks = []
+        # Files opened by the session itself, closed along with the files of
+        # its metrics
+        self._open_files = []
 
         self.callbacks = []
+        # Callbacks that implement `on_update`, so no-op stubs are skipped
+        self._update_callbacks = []
         if callbacks:
             for callback in callbacks:
                 self.add_callback(callback)
-        self.call_callbacks(lambda h: h.on_session_start())
-
-        self._metrics = []
+        for callback in self.callbacks:
+            callback.on_session_start()
+
+        # Metrics by name, in the order they were added
+        self._metrics = {}
+        self._plottable = []
+        self._serializable = []
+        # Last plot of each metric, with the metric version it was made from
+        self._plot_cache = {}
+        self._plotted_versions = None
+        self._serialized_versions = {}
         if metrics:
             for metric in metrics:
                 self.add_metric(metric)
+        # Release the serialization files if the session is never closed
+        self._finalizer = weakref.finalize(
+            self, _close_files, self._serializable, self._open_files
+        )
+
+        self._plot_condition = threading.Condition()
+        self._plot_thread = None
+        self._pending_layout = None
+        self._plotting = False
+        self._closing = False
+        # Raised from `flush` if writing a plot in the background failed
+        self._plot_error = None
 
         self._update_actions = []
+        if plot_metrics and importlib.util.find_spec("holoviews") is None:
+            # Fail early with the install hint, without importing holoviews
+            _import_holoviews()
         if plot_metrics:
-            self._update_actions.append(self.plot)
+            if background_plot:
+                self._update_actions.append(self._plot_in_background)
+            else:
+                self._update_actions.append(self.plot)
         if serialize_metrics:
             self._update_actions.append(self.serialize)
 
     @property
     def metrics(self):
         """Get the metrics tracked by this session."""
-        return self._metrics
+        return list(self._metrics.values())
 
     def add_metric(self, metric):
         """Add a metric to the session."""
-        if metric.name in [m.name for m in self._metrics]:
+        if metric.name in self._metrics:
             raise ValueError(f"Session already has metric with name: {metric.name}")
-        self._metrics.append(metric)
-        self.call_callbacks(lambda h: h.on_metric_add(metric))
+        self._metrics[metric.name] = metric
+        if isinstance(metric, PlottableMetric):
+            self._plottable.append(metric)
+        if isinstance(metric, SerializableMetric):
+            self._serializable.append(metric)
+            self._serialize_paths[metric.name] = self._serialize_dir / metric.name
+        for callback in self.callbacks:
+            callback.on_metric_add(metric)
 
     def add_callback(self, callback):
         """Add a `SessionCallback` to the session."""
         callback.set_session(self)
         self.callbacks.append(callback)
+        self._refresh_update_callbacks()
 
     def remove_callback(self, callback):
         """Remove a `SessionCallback` from the session."""
         self.callbacks.remove(callback)
+        self._refresh_update_callbacks()
+
+    def _refresh_update_callbacks(self):
+        # Also called by callbacks when their `on_update` is reassigned
+        self._update_callbacks = [
+            callback for callback in self.callbacks if _overrides(callback, "on_update")
+        ]
 
     def call_callbacks(self, fn):
-        """Call a function with each callback as an argument."""
+        """Call a function with each callback as an argument.
+
+        Kept for custom events. The session dispatches its own events to its
+        callbacks directly.
+
+        """
         for callback in self.callbacks:
             fn(callback)
 
     def update(self):
-        """Update the session outputs."""
+        """Update the session outputs.
+
+        Inside of a `batch`, the update is deferred until the batch ends.
+
+        """
+        if self._batch_depth:
+            self._update_deferred = True
+            return
         for action in self._update_actions:
             action()
-        self.call_callbacks(lambda h: h.on_update())
+        for callback in self._update_callbacks:
+            callback.on_update()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Defer session updates until the end of a block of metric updates.
+
+        Updates requested inside the block, e.g. by a `SessionManager`, are
+        merged into a single update when the block exits, so the outputs never
+        reflect a partially updated set of metrics. Batches can be nested. If
+        the block raises, the deferred update is dropped.
+
+        Examples
+        --------
+        >>> import experimenttools as et
+        >>> import tempfile
+        >>> m0 = et.metrics.NumericMetric("m0")
+        >>> m1 = et.metrics.NumericMetric("m1")
+        >>> session = et.Session(tempfile.mkdtemp(), metrics=[m0, m1])
+        >>> manager = et.SessionManager(session, update_type="updates", update_freq=3)
+        >>> _ = manager.manage()
+        >>> for i in range(5):
+        ...     with session.batch():
+        ...         m0(i)
+        ...         m1(2*i)
+
+        """
+        self._batch_depth += 1
+        completed = False
+        try:
+            yield self
+            completed = True
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._update_deferred:
+                self._update_deferred = False
+                # Updates requested in a batch that raised are dropped
+                if completed:
+                    self.update()
 
     def plot(self):
-        """Plot all plottable metrics."""
-        self.output_dir.mkdir(exist_ok=True, parents=True)
-        plots = []
-        for metric in self._metrics:
-            if isinstance(metric, PlottableMetric):
-                plots.append(metric.plot())
-        layout = hv.Layout(plots)
-        hv.save(layout, self.output_dir / "index.html")
+        """Plot all plottable metrics.
+
+        Plots are cached per metric and only regenerated for metrics that
+        have been updated since the last call. Nothing is written if no
+        plottable metric has been updated.
+
+        """
+        # Don't race with a plot being written in the background
+        self.flush()
+        versions = self._plottable_versions()
+        if versions == self._plotted_versions:
+            return
+        self._save_layout(self._layout())
+        self._plotted_versions = versions
+
+    def flush(self):
+        """Wait until all plots pending in the background have been written.
+
+        Raises
+        ------
+        Exception
+                The error raised while writing a plot in the background, if
+                any, since the last call.
+
+        """
+        with self._plot_condition:
+            while self._pending_layout is not None or self._plotting:
+                self._plot_condition.wait()
+            error = self._plot_error
+            self._plot_error = None
+        if error is not None:
+            raise error
+
+    def _plottable_versions(self):
+        return [metric._version for metric in self._plottable]
+
+    def _layout(self):
+        plots = [self._cached_plot(metric) for metric in self._plottable]
+        return _import_holoviews().Layout(plots)
+
+    # Directories are created on first use rather than on every update
+    def _ensure_output_dir(self):
+        if not self._output_dir_created:
+            self.output_dir.mkdir(exist_ok=True, parents=True)
+            self._output_dir_created = True
+
+    def _ensure_serialize_dir(self):
+        if not self._serialize_dir_created:
+            self._serialize_dir.mkdir(exist_ok=True, parents=True)
+            self._serialize_dir_created = True
+
+    def _save_layout(self, layout):
+        self._ensure_output_dir()
+        if self._live_refresh:
+            self._save_live_layout(layout)
+        else:
+            _import_holoviews().save(layout, self._index_path)
+
+    def _save_live_layout(self, layout):
+        from bokeh.embed import json_item
+
+        if not self._live_page_written:
+            from bokeh.resources import CDN
+
+            page = _LIVE_REFRESH_HTML.format(
+                title=html.escape(self.name or "experimenttools"),
+                resources=CDN.render(),
+                interval=_LIVE_REFRESH_INTERVAL_MS,
+            )
+            with open(self._index_path, "w") as f:
+                f.write(page)
+            self._live_page_written = True
+        item = json_item(_import_holoviews().render(layout), "experimenttools-plot")
+        # Written in place rather than replaced so hard links to the file,
+        # like the ones made by `SessionServer`, stay valid
+        with open(self._index_json_path, "w") as f:
+            json.dump(item, f)
+
+    def _plot_in_background(self):
+        # Plots are built here so they capture the current metric values, but
+        # only rendering the layout to html happens on the plot thread
+        versions = self._plottable_versions()
+        if versions == self._plotted_versions:
+            return
+        layout = self._layout()
+        self._plotted_versions = versions
+        with self._plot_condition:
+            if self._plot_thread is None or not self._plot_thread.is_alive():
+                self._plot_thread = threading.Thread(
+                    target=self._plot_worker, name="experimenttools-plot", daemon=True
+                )
+                self._plot_thread.start()
+            self._pending_layout = layout
+            self._plot_condition.notify_all()
+
+    def _plot_worker(self):
+        while True:
+            with self._plot_condition:
+                while self._pending_layout is None and not self._closing:
+                    self._plot_condition.wait()
+                if self._pending_layout is None:
+                    return
+                layout = self._pending_layout
+                self._pending_layout = None
+                self._plotting = True
+            error = None
+            try:
+                self._save_layout(layout)
+            except Exception as e:
+                # Keep plotting, the error is raised by the next `flush`
+                error = e
+            finally:
+                with self._plot_condition:
+                    if error is not None:
+                        self._plot_error = error
+                    self._plotting = False
+                    self._plot_condition.notify_all()
+
+    def _cached_plot(self, metric):
+        cached = self._plot_cache.get(metric.name)
+        if cached is not None and cached[0] == metric._version:
+            return cached[1]
+        plot = metric.plot()
+        self._plot_cache[metric.name] = (metric._version, plot)
+        return plot
 
     def serialize(self):
-        """Serialize all serializable metrics."""
-        self.output_dir.mkdir(exist_ok=True, parents=True)
-        serialize_dir = self.output_dir / "serialized"
-        serialize_dir.mkdir(exist_ok=True)
-        for metric in self._metrics:
-            if isinstance(metric, SerializableMetric):
-                metric.serialize(serialize_dir / metric.name)
+        """Serialize all serializable metrics.
+
+        Metrics that have not been updated since they were last serialized by
+        the session are skipped.
+
+        """
+        self._ensure_serialize_dir()
+        metrics = self._changed_serializable()
+        if self._aggregate_serialize:
+            self._serialize_aggregated(metrics)
+            return
+        for metric in metrics:
+            metric.serialize(self._serialize_paths[metric.name])
+            # Recorded after writing so metrics that failed are retried
+            self._serialized_versions[metric.name] = metric._version
+
+    def _changed_serializable(self):
+        return [
+            metric
+            for metric in self._serializable
+            if self._serialized_versions.get(metric.name) != metric._version
+        ]
+
+    def _serialize_aggregated(self, metrics):
+        if self._log_file is None:
+            log_path = self._serialize_dir / "metrics.log"
+            self._log_file = open(log_path, "ab", buffering=0)
+            self._log_index_file = open(self._serialize_dir / "metrics.index.csv", "a")
+            self._open_files += [self._log_file, self._log_index_file]
+        for metric in metrics:
+            chunk = metric.serialize_bytes()
+            # The session holds on to the chunk until it has been written
+            self._serialized_versions[metric.name] = metric._version
+            if chunk:
+                self._unwritten_chunks.append((metric.name, chunk))
+        if not self._unwritten_chunks:
+            return
+        offset = self._log_file.tell()
+        index = []
+        for name, chunk in self._unwritten_chunks:
+            index.append(f"{name},{offset},{len(chunk)}\n")
+            offset += len(chunk)
+        # Bytes left by a failed write are never referenced by the index
+        _write_all(self._log_file, b"".join(c for _, c in self._unwritten_chunks))
+        self._unwritten_chunks = []
+        self._log_index_file.write("".join(index))
+        self._log_index_file.flush()
+
+    def close(self):
+        """Write pending plots and release resources held by the session.
+
+        Stops the background plot thread, if any, and closes the files held
+        open by serializable metrics. Errors from plots written in the
+        background are raised once the resources are released. The files of
+        sessions that are never closed are closed when the session is garbage
+        collected or at interpreter exit.
+
+        """
+        try:
+            self.flush()
+        finally:
+            self._close_resources()
+
+    def _close_resources(self):
+        if self._plot_thread is not None:
+            with self._plot_condition:
+                self._closing = True
+                self._plot_condition.notify_all()
+            self._plot_thread.join()
+            self._plot_thread = None
+            self._closing = False
+        _close_files(self._serializable, self._open_files)
+        self._log_file = None
+        self._log_index_file = None
+
+
+def _close_files(metrics, files):
+    """Close the files held open for a session and its metrics."""
+    for metric in metrics:
+        metric.close()
+    for file in files:
+        file.close()
+    files.clear()
+
+
+def load_aggregated_metrics(serialize_dir):
+    """Read the metrics serialized by a session using `aggregate_serialize`.
+
+    Parameters
+    ----------
+    serialize_dir: path-like object
+            The `serialized` directory of the session.
+
+    Returns
+    -------
+    dict of str:bytes
+            The serialized output of each metric, identical to the contents of
+            the file the metric writes when serialized on its own.
+
+    """
+    serialize_dir = Path(serialize_dir)
+    chunks = {}
+    with open(serialize_dir / "metrics.log", "rb") as log, open(
+        serialize_dir / "metrics.index.csv"
+    ) as index:
+        for line in index:
+            # Metric names may contain commas
+            name, offset, length = line.rstrip("\n").rsplit(",", 2)
+            log.seek(int(offset))
+            chunks.setdefault(name, []).append(log.read(int(length)))
+    return {name: b"".join(c) for name, c in chunks.items()}
 
 
 class SessionManager:
@@ -191,25 +600,36 @@ class SessionManager:
 
         """
         self._verbose = verbose
+        if not verbose:
+            # Avoid the method call entirely when nothing would be printed
+            self._log = self._no_log
         self._session = session
         self._managing = False
         self._session_callback = LambdaSessionCallback(
             on_metric_add=lambda m: m.add_callback(self.process_metric_update)
         )
+        self._update_freq = update_freq
+        self._update_freq_ns = int(update_freq * 1e9)
+        # Pick the update check once so metric updates do not dispatch on
+        # `update_type`
         if update_type == "seconds":
-            self._last_update_seconds = time.time()
+            self._last_update_ns = time.monotonic_ns()
+            self.process_metric_update = self._process_seconds
         elif update_type == "updates":
-            self._num_updates = 0
+            self.process_metric_update = self._make_process_updates()
         else:
             raise ValueError(
                 f"Uknown value for parameter 'update_type': '{update_type}'"
             )
-        self._update_freq = update_freq
         self._log(2, f"Session outputting to {self._session.output_dir}")
 
     def _log(self, level, msg):
         if self._verbose >= level:
-            print(f"{datetime.now()}: expeexperimenttools.SessionManager] {msg}")
+            print(f"{datetime.now()}: [experimenttools.SessionManager] {msg}")
+
+    @staticmethod
+    def _no_log(level, msg):
+        pass
 
     def manage(self):
         """Beginning managing the sesssion.
@@ -222,6 +642,8 @@ class SessionManager:
                 If the manager has already begun to manage the session.
 
         """
+        if self._managing:
+            raise RuntimeError("Manager is already managing the session")
         self._log(2, "Beginning management")
         self._managing = True
         self._session.add_callback(self._session_callback)
@@ -233,7 +655,9 @@ class SessionManager:
         """Stop managing the session.
 
         The manager will no longer update the session when metrics have
-        been updated.
+        been updated. The session is closed, which waits for any plots still
+        being written in the background and closes its serialization files.
+        They are reopened if the session is updated again.
 
         Raises
         ------
@@ -241,10 +665,14 @@ class SessionManager:
                 If the manager is not currently managing the session.
 
         """
+        if not self._managing:
+            raise RuntimeError("Manager is not managing the session")
         self._log(2, "Ending management")
         self._session.remove_callback(self._session_callback)
         for m in self._session.metrics:
             m.remove_callback(self.process_metric_update)
+        self._managing = False
+        self._session.close()
 
     @property
     def session(self):
@@ -260,17 +688,32 @@ class SessionManager:
         """Close the session manager upon exiting the context."""
         self.close()
 
-    def process_metric_update(self, _):
-        """Update the session if the update frequency has been reached."""
-        try:
-            if time.time() - self._last_update_seconds >= self._update_freq:
-                self._log(2, "Updating session")
-                self._session.update()
-                self._last_update_seconds = time.time()
-        except AttributeError:
-            if self._num_updates + 1 >= self._update_freq:
-                self._log(2, "Updating session")
-                self._session.update()
-                self._num_updates = 0
-            else:
-                self._num_updates += 1
+    def _process_seconds(self, _):
+        """Update the session if `update_freq` seconds have passed."""
+        now = time.monotonic_ns()
+        if now - self._last_update_ns >= self._update_freq_ns:
+            self._log(2, "Updating session")
+            self._session.update()
+            self._last_update_ns = now
+
+    def _make_process_updates(self):
+        """Create a callback updating the session every `update_freq` updates.
+
+        The state used on every metric update is held in closure variables
+        rather than looked up as attributes of the manager.
+
+        """
+        session = self._session
+        update_freq = self._update_freq
+        log = self._log
+        remaining = update_freq
+
+        def process_updates(_):
+            nonlocal remaining
+            remaining -= 1
+            if remaining <= 0:
+                log(2, "Updating session")
+                session.update()
+                remaining = update_freq
+
+        return process_updates
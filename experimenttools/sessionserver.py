@@ -8,9 +8,11 @@ import contextlib
 import http.server
 import os
 import socket
+import uuid
 from pathlib import Path
 
 from experimenttools import Session
+from experimenttools.sessions import _index_paths
 
 
 class SessionServer:
@@ -56,8 +58,8 @@ class SessionServer:
         ----------
         session : Sesssion or (str, str)
                 The `Session` to add. If passing in a `Session`, the session
-                will be updated before it is added to ensure that its outputs
-                have been created. If `(str, str)`, the first `str` should be
+                will be updated before it is added if its outputs have not
+                been created yet. If `(str, str)`, the first `str` should be
                 the session name and the second should be the session output
                 directory. Ensure that session has been updated if using this
                 method.
@@ -68,19 +70,22 @@ class SessionServer:
                 raise ValueError(
                     "Sessions must have names to be added to a session server."
                 )
-            # Update the session so that index.html is generated
-            session.update()
+            # Update the session only if index.html has not been generated
+            session.flush()
+            if not session._index_path.is_file():
+                session.update()
+                session.flush()
             sess_name = session.name
-            sess_output_dir = session.output_dir
+            src_html_path = session._index_path
+            src_json_path = session._index_json_path
         else:
             sess_name, sess_output_dir = session
-            sess_output_dir = Path(sess_output_dir)
+            src_html_path, src_json_path = _index_paths(Path(sess_output_dir))
         self.output_dir.mkdir(exist_ok=True, parents=True)
-        src_html_path = sess_output_dir / "index.html"
-        dest_html_path = self.output_dir / f"{sess_name}.html"
-        if dest_html_path.is_file():
-            dest_html_path.unlink()
-        os.link(src_html_path, dest_html_path)
+        _link(src_html_path, self.output_dir / f"{sess_name}.html")
+        # Plots loaded by sessions using `live_refresh`
+        if src_json_path.is_file():
+            _link(src_json_path, self.output_dir / f"{sess_name}.json")
 
     def serve(self, port=8000, bind="127.0.0.1"):
         """Start the server.
@@ -110,6 +115,21 @@ class SessionServer:
         _run_server(ServerClass=DualStackServer, port=port, bind=bind)
 
 
+def _link(src_path, dest_path):
+    # Link under a temporary name, then atomically move it over `dest_path`.
+    # The name is unique so concurrent links to the same file don't collide.
+    tmp_path = dest_path.with_name(
+        f".{dest_path.name}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+    )
+    os.link(src_path, tmp_path)
+    try:
+        os.replace(tmp_path, dest_path)
+    finally:
+        # Renaming does nothing if both names already link to the same file
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+
+
 def _run_server(ServerClass, protocol="HTTP/1.0", port=8000, bind=None):
     HandlerClass = http.server.SimpleHTTPRequestHandler
     ServerClass.address_family, addr = http.server._get_best_family(bind, port)
@@ -1,16 +1,22 @@
+import io
 import tempfile
 import unittest
+from pathlib import Path
 
-import experimenttools as et
+from experimenttools.metrics import (
+    NumericMetric,
+    ParameterSetMetric,
+    TimedNumericMetric,
+)
 
 
 class TestMetrics(unittest.TestCase):
     def test_numeric_metric_ops(self):
-        m0 = et.metrics.NumericMetric("m0")
+        m0 = NumericMetric("m0")
         with self.assertRaises(ValueError):
             m0.value
 
-        m0 = et.metrics.NumericMetric("m0", 0)
+        m0 = NumericMetric("m0", 0)
         m0 += 1
         self.assertEqual(m0.value, 1)
         m0 *= 3
@@ -18,16 +24,114 @@ class TestMetrics(unittest.TestCase):
         m0 /= 3
         self.assertEqual(m0.value, 1)
 
+    def test_numeric_metric_integer_ops(self):
+        calls = []
+        m0 = NumericMetric("m0", 12, callbacks=[calls.append])
+        m0 -= 2
+        m0 //= 3
+        m0 **= 2
+        m0 %= 7
+        m0 <<= 3
+        m0 >>= 1
+        m0 &= 6
+        m0 |= 1
+        m0 ^= 2
+        self.assertListEqual(m0.values, [12, 10, 3, 9, 2, 16, 8, 0, 1, 3])
+        self.assertEqual(len(calls), 10)
+
+    def test_metric_callbacks(self):
+        calls = []
+        m0 = NumericMetric("m0")
+        m0(0)
+        m0.add_callback(lambda m: calls.append(("a", m.value)))
+        m0(1)
+        m0.add_callback(lambda m: calls.append(("b", m.value)))
+        m0(2)
+        self.assertListEqual(calls, [("a", 1), ("a", 2), ("b", 2)])
+
+        for callback in list(m0._callbacks):
+            m0.remove_callback(callback)
+        m0(3)
+        self.assertEqual(len(calls), 3)
+
+    def test_numeric_metric_extend(self):
+        calls = []
+        m0 = NumericMetric("m0", 0, callbacks=[calls.append])
+        m0.extend(range(1, 4))
+        m0.extend([])
+        self.assertListEqual(m0.values, [0, 1, 2, 3])
+        self.assertEqual(len(calls), 2)
+
+        def failing_values():
+            yield 16
+            raise RuntimeError
+
+        with self.assertRaises(RuntimeError):
+            m0.extend(failing_values())
+        self.assertListEqual(m0.values, [0, 1, 2, 3])
+        self.assertEqual(len(calls), 2)
+
+        m1 = TimedNumericMetric("m1", 0, callbacks=[calls.append])
+        m1.extend(i * i for i in range(1, 4))
+        m1.extend([])
+        self.assertListEqual(m1.values, [0, 1, 4, 9])
+        self.assertEqual(len(m1.times), 4)
+        self.assertEqual(len(set(m1.times[1:])), 1)
+        self.assertLessEqual(m1.times[0], m1.times[1])
+        self.assertEqual(len(calls), 4)
+
+        with self.assertRaises(RuntimeError):
+            m1.extend(failing_values())
+        self.assertListEqual(m1.values, [0, 1, 4, 9])
+        self.assertEqual(len(m1.times), 4)
+        self.assertEqual(len(calls), 4)
+
+    def test_numeric_metric_serialize(self):
+        m0 = NumericMetric("m0")
+        m1 = TimedNumericMetric("m1")
+        with tempfile.TemporaryDirectory(prefix="experimenttools_tests_") as tmpdir:
+            for i in range(3):
+                m0.serialize(Path(tmpdir) / "m0")
+                m1.serialize(Path(tmpdir) / "m1")
+                m0(i)
+                m1(i)
+                m1(-i)
+            m0.serialize(Path(tmpdir) / "m0")
+            m1.serialize(Path(tmpdir) / "m1")
+            m0.close()
+            m1.close()
+
+            with open(Path(tmpdir) / "m0.csv") as f:
+                self.assertEqual(f.read(), "value\n0\n1\n2\n")
+            with open(Path(tmpdir) / "m1.csv") as f:
+                lines = f.read().split()
+            self.assertEqual(lines[0], "time,value")
+            self.assertListEqual(
+                [int(line.split(",")[1]) for line in lines[1:]], [0, 0, 1, -1, 2, -2]
+            )
+
+    def test_numeric_metric_serialize_short_writes(self):
+        class ShortWriter(io.BytesIO):
+            def write(self, data):
+                # Like a raw file write that only writes part of the data
+                return super().write(bytes(data[:3]))
+
+        m0 = NumericMetric("m0")
+        m0.extend(range(10))
+        m0._file = ShortWriter()
+        m0.serialize("m0")
+        expected = "value\n" + "".join(f"{i}\n" for i in range(10))
+        self.assertEqual(m0._file.getvalue(), expected.encode())
+
     def test_parameter_set_metric(self):
         data = {"a": 1, "b": "c"}
-        m = et.metrics.ParameterSetMetric("test", data)
+        m = ParameterSetMetric("test", data)
         with tempfile.NamedTemporaryFile(
             prefix="experimenttools_tests_", mode="r", suffix=".csv"
         ) as f:
             m.serialize(f.name.split(".")[0])
-            read_data = {
-                l.split(",")[0]: l.split(",")[1] for l in f.read().split("\n")[1:] if l
-            }
+            rows = (line.split(",") for line in f.read().split("\n")[1:] if line)
+            read_data = {key: value for key, value in rows}
 
         # Will be string when read back in
         data["a"] = "1"
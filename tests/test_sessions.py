@@ -1,145 +1,704 @@
+"""Tests for sessions, session managers and session servers.
+
+Each test gets its own directory under a per-process temporary root, and no
+state is shared between tests, so they are safe to run in parallel with
+`pytest -n auto` (pytest-xdist) as well as in any order.
+
+"""
+
+import gc
+import json
+import mmap
+import os
+import re
+import subprocess
+import sys
 import tempfile
+import threading
 import unittest
 from pathlib import Path
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
+
+from experimenttools import Session, SessionManager, SessionServer
+from experimenttools.callbacks import LambdaSessionCallback, SessionCallback
+from experimenttools.metrics import (
+    Metric,
+    NumericMetric,
+    ParameterSetMetric,
+    TimedNumericMetric,
+)
+from experimenttools.sessions import load_aggregated_metrics
+from experimenttools.sessionserver import _link
+
+
+def _tmpdir():
+    """Get a memory backed directory for test files, if one is available."""
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return None
+
+
+# The integer at the end of a csv row
+_LAST_COLUMN = re.compile(rb"(?:^|,)(-?\d+)\r?$", re.MULTILINE)
+
+
+def _parse_values(data):
+    """Parse the last column of the rows after the header as ints."""
+    header_end = data.find(b"\n")
+    rows = data[header_end + 1 :] if header_end >= 0 else b""
+    values = _LAST_COLUMN.findall(rows)
+    # Fail on malformed rows rather than silently skipping them
+    n_rows = len(rows.splitlines())
+    if len(values) != n_rows:
+        raise ValueError(f"Only {len(values)} of {n_rows} rows end in an integer")
+    return list(map(int, values))
+
+
+def _load_values(path):
+    """Load the last column of a serialized metric file as a list of ints."""
+    with open(path, "rb") as f:
+        # Empty files can not be mapped
+        if not os.fstat(f.fileno()).st_size:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _parse_values(mm)
+
+
+class _Counter:
+    """Count how many times it is called."""
+
+    __slots__ = ("n",)
 
-import experimenttools as et
+    def __init__(self):
+        self.n = 0
+
+    def __call__(self, *args, **kwargs):
+        self.n += 1
 
 
 class TestSessions(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls._root = tempfile.TemporaryDirectory(
+            prefix="experimenttools_tests_", dir=_tmpdir()
+        )
+        cls._tmproot = Path(cls._root.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._root.cleanup()
+
+    def make_tmpdir(self):
+        """Create a new directory for the current test.
+
+        The directory is not removed when the test ends. Everything is removed
+        at once in `tearDownClass`.
+
+        """
+        return tempfile.mkdtemp(prefix=f"{self._testMethodName}_", dir=self._tmproot)
+
     def test_session(self):
-        m0 = et.metrics.NumericMetric("m0")
-        m1 = et.metrics.TimedNumericMetric("m1")
+        m0 = NumericMetric("m0")
+        m1 = TimedNumericMetric("m1")
 
-        with tempfile.TemporaryDirectory(prefix="experimenttools_tests_") as tmpdir:
-            session = et.Session(tmpdir, metrics=[m0, m1])
+        tmpdir = self.make_tmpdir()
+        session = Session(tmpdir, metrics=[m0, m1])
 
-            m0_expected = []
-            m1_expected = []
-            for i in range(5):
-                m0(i)
-                m0_expected.append(i)
-                m1(i * i)
-                m1_expected.append(i * i)
+        m0_expected = list(range(5))
+        m1_expected = [i * i for i in range(5)]
+        m0.extend(m0_expected)
+        m1.extend(m1_expected)
 
-            session.update()
+        session.update()
+
+        tmpdir = Path(tmpdir)
+        self.assertTrue((tmpdir / "index.html").is_file())
+        m0_actual = _load_values(tmpdir / "serialized" / "m0.csv")
+        self.assertListEqual(m0_expected, m0_actual)
+        m1_actual = _load_values(tmpdir / "serialized" / "m1.csv")
+        self.assertListEqual(m1_expected, m1_actual)
+
+    def test_session_plot_only(self):
+        m0 = NumericMetric("m0", 0)
 
-            tmpdir = Path(tmpdir)
-            self.assertTrue((tmpdir / "index.html").is_file())
-            with open(tmpdir / "serialized" / "m0.csv") as f:
-                m0_actual = [int(l) for l in f.read().split()[1:]]
-            self.assertListEqual(m0_expected, m0_actual)
-            with open(tmpdir / "serialized" / "m1.csv") as f:
-                m1_actual = [int(l.split(",")[-1]) for l in f.read().split()[1:]]
-            self.assertListEqual(m1_expected, m1_actual)
+        tmpdir = self.make_tmpdir()
+        session = Session(tmpdir, metrics=[m0], serialize_metrics=False)
+        session.update()
+        tmpdir = Path(tmpdir)
+        self.assertTrue((tmpdir / "index.html").is_file())
+        self.assertFalse((tmpdir / "serialized").exists())
+
+    def test_session_metric_kinds(self):
+        m0 = NumericMetric("m0")
+        m1 = Metric("m1")
+        m2 = ParameterSetMetric("m2", {"a": 1})
+
+        tmpdir = self.make_tmpdir()
+        session = Session(tmpdir, metrics=[m0, m1, m2], plot_metrics=False)
+        self.assertListEqual(session.metrics, [m0, m1, m2])
+        self.assertListEqual(session._plottable, [m0, m2])
+        self.assertListEqual(session._serializable, [m0, m2])
+        with self.assertRaises(ValueError):
+            session.add_metric(NumericMetric("m1"))
+
+        m0(0)
+        m1()
+        session.update()
+        tmpdir = Path(tmpdir)
+        self.assertListEqual(
+            sorted(p.name for p in (tmpdir / "serialized").iterdir()),
+            ["m0.csv", "m2.csv"],
+        )
 
     def test_session_callbacks(self):
-        m0 = et.metrics.NumericMetric("m0")
-        m1 = et.metrics.TimedNumericMetric("m1")
+        m0 = NumericMetric("m0")
+        m1 = TimedNumericMetric("m1")
 
-        mock = Mock()
+        counter = _Counter()
 
-        callback = et.callbacks.LambdaSessionCallback(
-            on_session_start=mock.method,
-            on_metric_add=mock.method,
-            on_update=mock.method,
+        callback = LambdaSessionCallback(
+            on_session_start=counter,
+            on_metric_add=counter,
+            on_update=counter,
+        )
+        tmpdir = self.make_tmpdir()
+        session = Session(
+            tmpdir,
+            metrics=[m0],
+            callbacks=[callback],
+            plot_metrics=False,
+            serialize_metrics=False,
         )
-        with tempfile.TemporaryDirectory(prefix="experimenttools_tests_") as tmpdir:
-            session = et.Session(tmpdir, metrics=[m0], callbacks=[callback])
 
-            self.assertEqual(mock.method.call_count, 2)
-            session.add_metric(m1)
-            self.assertEqual(mock.method.call_count, 3)
-            session.update()
-            self.assertEqual(mock.method.call_count, 4)
+        self.assertEqual(counter.n, 2)
+        session.add_metric(m1)
+        self.assertEqual(counter.n, 3)
+        session.update()
+        self.assertEqual(counter.n, 4)
 
     def test_session_manager(self):
-        m0 = et.metrics.NumericMetric("m0")
+        m0 = NumericMetric("m0")
 
-        with tempfile.TemporaryDirectory(prefix="experimenttools_tests_") as tmpdir:
-            session = et.Session(tmpdir, metrics=[m0])
-            et.SessionManager(session, update_type="updates", update_freq=2).manage()
-            m0_expected = []
-            for i in range(5):
-                m0(i)
-                m0_expected.append(i)
+        tmpdir = self.make_tmpdir()
+        session = Session(tmpdir, metrics=[m0], plot_metrics=False)
+        SessionManager(session, update_type="updates", update_freq=2).manage()
+        m0_expected = []
+        for i in range(5):
+            m0(i)
+            m0_expected.append(i)
 
-            # Last metric update should not have triggered a session update
-            m0_expected = m0_expected[:-1]
-            tmpdir = Path(tmpdir)
-            self.assertTrue((tmpdir / "index.html").is_file())
-            with open(tmpdir / "serialized" / "m0.csv") as f:
-                m0_actual = [int(l) for l in f.read().split()[1:]]
-            self.assertListEqual(m0_expected, m0_actual)
+        # Last metric update should not have triggered a session update
+        m0_expected = m0_expected[:-1]
+        tmpdir = Path(tmpdir)
+        self.assertFalse((tmpdir / "index.html").exists())
+        m0_actual = _load_values(tmpdir / "serialized" / "m0.csv")
+        self.assertListEqual(m0_expected, m0_actual)
 
-    def test_session_manager_close(self):
-        m0 = et.metrics.NumericMetric("m0")
+    def test_session_manager_update_type(self):
+        m0 = NumericMetric("m0")
 
-        with tempfile.TemporaryDirectory(prefix="experimenttools_tests_") as tmpdir:
-            session = et.Session(tmpdir, metrics=[m0])
-            manager = et.SessionManager(
-                session, update_type="updates", update_freq=2
+        tmpdir = self.make_tmpdir()
+        session = Session(tmpdir, metrics=[m0])
+        with self.assertRaises(ValueError):
+            SessionManager(session, update_type="iterations")
+
+        manager = SessionManager(session, update_type="updates", update_freq=2)
+        with patch.object(session, "update") as update:
+            with manager.manage():
+                # The update check is registered directly, without a wrapper
+                self.assertEqual(len(m0._callbacks), 1)
+                self.assertIs(m0._callbacks[0], manager.process_metric_update)
+                for i in range(5):
+                    m0(i)
+            self.assertEqual(update.call_count, 2)
+            self.assertListEqual(m0._callbacks, [])
+
+    def test_session_manager_seconds(self):
+        m0 = NumericMetric("m0")
+        clock = [0]
+
+        tmpdir = self.make_tmpdir()
+        session = Session(tmpdir, metrics=[m0])
+        with patch(
+            "experimenttools.sessions.time.monotonic_ns", lambda: clock[0]
+        ), patch.object(session, "update") as update:
+            manager = SessionManager(
+                session, update_type="seconds", update_freq=1.5
             ).manage()
+            self.assertListEqual(m0._callbacks, [manager.process_metric_update])
+            self.assertIs(m0._callbacks[0], manager.process_metric_update)
+            for t in [0.5, 1.0, 1.5, 2.0, 3.0, 3.5]:
+                clock[0] = int(t * 1e9)
+                m0(t)
+            manager.close()
+        # Updates at 1.5 and 3.0 seconds
+        self.assertEqual(update.call_count, 2)
+
+    def test_session_manager_close(self):
+        m0 = NumericMetric("m0")
+
+        tmpdir = self.make_tmpdir()
+        session = Session(tmpdir, metrics=[m0])
+        manager = SessionManager(session, update_type="updates", update_freq=2).manage()
+        with self.assertRaises(RuntimeError):
+            manager.manage()
+        m0_expected = []
+        for i in range(6):
+            m0(i)
+            m0_expected.append(i)
+
+        manager.close()
+        with self.assertRaises(RuntimeError):
+            manager.close()
+        # Should not triggered a session updates
+        for i in range(6):
+            m0(i * i)
+
+        tmpdir = Path(tmpdir)
+        self.assertTrue((tmpdir / "index.html").is_file())
+        m0_actual = _load_values(tmpdir / "serialized" / "m0.csv")
+        self.assertListEqual(m0_expected, m0_actual)
+
+    def test_session_manager_context(self):
+        m0 = NumericMetric("m0")
+
+        tmpdir = self.make_tmpdir()
+        session = Session(tmpdir, metrics=[m0])
+        with SessionManager(session, update_type="updates", update_freq=2).manage():
             m0_expected = []
             for i in range(6):
                 m0(i)
                 m0_expected.append(i)
 
-            manager.close()
-            # Should not triggered a session updates
-            for i in range(6):
-                m0(i * i)
+        # Should not triggered a session updates
+        for i in range(6):
+            m0(i * i)
 
-            tmpdir = Path(tmpdir)
-            self.assertTrue((tmpdir / "index.html").is_file())
-            with open(tmpdir / "serialized" / "m0.csv") as f:
-                m0_actual = [int(l) for l in f.read().split()[1:]]
-            self.assertListEqual(m0_expected, m0_actual)
+        tmpdir = Path(tmpdir)
+        self.assertTrue((tmpdir / "index.html").is_file())
+        m0_actual = _load_values(tmpdir / "serialized" / "m0.csv")
+        self.assertListEqual(m0_expected, m0_actual)
+        # Closing the manager closes the session files
+        self.assertIsNone(m0._file)
 
-    def test_session_manager_context(self):
-        m0 = et.metrics.NumericMetric("m0")
-
-        with tempfile.TemporaryDirectory(prefix="experimenttools_tests_") as tmpdir:
-            session = et.Session(tmpdir, metrics=[m0])
-            with et.SessionManager(
-                session, update_type="updates", update_freq=2
-            ).manage():
-                m0_expected = []
-                for i in range(6):
-                    m0(i)
-                    m0_expected.append(i)
+    def test_session_close_files(self):
+        m0 = NumericMetric("m0", 0)
+        m1 = NumericMetric("m1", 0)
 
-            # Should not triggered a session updates
-            for i in range(6):
-                m0(i * i)
+        tmpdir = self.make_tmpdir()
+        session = Session(tmpdir, metrics=[m0], plot_metrics=False)
+        session.update()
+        file = m0._file
+        self.assertFalse(file.closed)
+        # Files are closed once the session is collected
+        del session
+        gc.collect()
+        self.assertTrue(file.closed)
+        self.assertIsNone(m0._file)
 
-            tmpdir = Path(tmpdir)
-            self.assertTrue((tmpdir / "index.html").is_file())
-            with open(tmpdir / "serialized" / "m0.csv") as f:
-                m0_actual = [int(l) for l in f.read().split()[1:]]
-            self.assertListEqual(m0_expected, m0_actual)
+        session = Session(
+            tmpdir,
+            metrics=[m1],
+            plot_metrics=False,
+            aggregate_serialize=True,
+        )
+        session.update()
+        files = [session._log_file, session._log_index_file]
+        session.close()
+        self.assertTrue(all(f.closed for f in files))
+        # Closed sessions can still be updated
+        m1(1)
+        session.update()
+        session.close()
+        metrics = load_aggregated_metrics(Path(tmpdir) / "serialized")
+        self.assertEqual(metrics["m1"], b"value\n0\n1\n")
 
     def test_session_server(self):
 
-        m0 = et.metrics.NumericMetric("m0")
-        m1 = et.metrics.NumericMetric("m1")
+        m0 = NumericMetric("m0")
+        m1 = NumericMetric("m1")
+
+        tmpdir = self.make_tmpdir()
+        tmpdir = Path(tmpdir)
+        session_0 = Session(tmpdir / "session_0", name="session_0", metrics=[m0])
+        session_1 = Session(tmpdir / "session_1", name="session_1", metrics=[m1])
+        server = SessionServer([session_0, session_1], tmpdir / "server")
+
+        for i in range(5):
+            m0(i)
+            m1(i * i)
+
+        session_0.update()
+        session_1.update()
+
+        for session in [session_0, session_1]:
+            with open(session.output_dir / "index.html") as f:
+                session_html = f.read()
+            with open(server.output_dir / f"{session.name}.html") as f:
+                server_html = f.read()
+            self.assertEqual(session_html, server_html)
+            # Only sessions using live_refresh write plots to json
+            self.assertFalse((server.output_dir / f"{session.name}.json").exists())
+
+        # Sessions can also be added by name and output directory
+        server.add_session(("session_2", session_0.output_dir))
+        self.assertTrue((server.output_dir / "session_2.html").is_file())
+
+    def test_session_plot_cache(self):
+        m0 = NumericMetric("m0", 0)
+
+        tmpdir = self.make_tmpdir()
+        session = Session(tmpdir, metrics=[m0])
+        m1 = NumericMetric("m1", 0)
+        session.add_metric(m1)
+        with patch.object(m0, "plot", wraps=m0.plot) as plot, patch.object(
+            session, "_save_layout", wraps=session._save_layout
+        ) as save:
+            session.plot()
+            session.plot()
+            self.assertEqual(plot.call_count, 1)
+            self.assertEqual(save.call_count, 1)
+            m1(1)
+            session.plot()
+            self.assertEqual(plot.call_count, 1)
+            self.assertEqual(save.call_count, 2)
+            m0(1)
+            session.plot()
+            self.assertEqual(plot.call_count, 2)
+            self.assertEqual(save.call_count, 3)
+
+    def test_session_update_unchanged(self):
+        for background_plot in [False, True]:
+            m0 = NumericMetric("m0", 0)
+            tmpdir = self.make_tmpdir()
+            session = Session(tmpdir, metrics=[m0], background_plot=background_plot)
+            with patch.object(session, "_save_layout") as save:
+                session.update()
+                session.update()
+                session.flush()
+                self.assertEqual(save.call_count, 1)
+            session.close()
+
+    def test_session_background_plot(self):
+        m0 = NumericMetric("m0")
+
+        tmpdir = self.make_tmpdir()
+        session = Session(tmpdir, metrics=[m0], background_plot=True)
+        for i in range(5):
+            m0(i)
+            session.update()
+        session.flush()
+
+        tmpdir = Path(tmpdir)
+        self.assertTrue((tmpdir / "index.html").is_file())
+        session.close()
+        self.assertIsNone(session._plot_thread)
+
+    def test_session_background_plot_error(self):
+        m0 = NumericMetric("m0")
+
+        tmpdir = self.make_tmpdir()
+        session = Session(tmpdir, metrics=[m0], background_plot=True)
+        with patch.object(
+            session, "_save_layout", side_effect=OSError("plot failed")
+        ) as save:
+            m0(0)
+            session.update()
+            with self.assertRaisesRegex(OSError, "plot failed"):
+                session.flush()
+            # The error is only raised once and plotting continues
+            session.flush()
+            m0(1)
+            session.update()
+            with self.assertRaises(OSError):
+                session.close()
+        self.assertEqual(save.call_count, 2)
+        self.assertIsNone(session._plot_thread)
+
+        # A plot thread that died is replaced
+        m0(2)
+        session.update()
+        session.flush()
+        with session._plot_condition:
+            session._closing = True
+            session._plot_condition.notify_all()
+        dead_thread = session._plot_thread
+        dead_thread.join()
+        session._closing = False
+        m0(3)
+        session.update()
+        self.assertIsNot(session._plot_thread, dead_thread)
+        session.close()
+        self.assertTrue((Path(tmpdir) / "index.html").is_file())
+
+    def test_session_update_callbacks(self):
+        updates = []
+
+        class UpdateCallback(SessionCallback):
+            def on_update(self):
+                updates.append(self.session)
+
+        update_callback = UpdateCallback()
+        start_callback = LambdaSessionCallback(on_session_start=Mock())
+        tmpdir = self.make_tmpdir()
+        session = Session(
+            tmpdir,
+            callbacks=[update_callback, start_callback],
+            plot_metrics=False,
+            serialize_metrics=False,
+        )
+        self.assertListEqual(session._update_callbacks, [update_callback])
+        session.update()
+        self.assertListEqual(updates, [session])
+
+        session.remove_callback(update_callback)
+        session.update()
+        self.assertListEqual(updates, [session])
+
+        # Handlers assigned after the callback is added are still called
+        start_callback.on_update = lambda: updates.append(None)
+        self.assertListEqual(session._update_callbacks, [start_callback])
+        session.update()
+        self.assertListEqual(updates, [session, None])
+
+    def test_session_serialize_unchanged(self):
+        m0 = NumericMetric("m0", 0)
+        m1 = ParameterSetMetric("m1", {"a": 1})
+
+        tmpdir = self.make_tmpdir()
+        session = Session(tmpdir, metrics=[m0, m1])
+        with patch.object(m0, "serialize") as m0_serialize, patch.object(
+            m1, "serialize"
+        ) as m1_serialize:
+            session.serialize()
+            session.serialize()
+            m0(1)
+            session.serialize()
+        self.assertEqual(m0_serialize.call_count, 2)
+        self.assertEqual(m1_serialize.call_count, 1)
+
+    def test_session_serialize_error(self):
+        def partial_write(file, data):
+            file.write(data[:4])
+            raise OSError("disk full")
+
+        m0 = NumericMetric("m0")
+        m1 = ParameterSetMetric("m1", {"a": 1})
+
+        tmpdir = self.make_tmpdir()
+        session = Session(tmpdir, metrics=[m1, m0], plot_metrics=False)
+        m0.extend(range(3))
+        with patch.object(m1, "_csv", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                session.update()
+        with patch("experimenttools.metrics._write_all", partial_write):
+            with self.assertRaises(OSError):
+                session.update()
+        # Nothing changed, but the rows that failed are written now
+        session.update()
+        session.close()
 
-        with tempfile.TemporaryDirectory(prefix="experimenttools_tests_") as tmpdir:
-            tmpdir = Path(tmpdir)
-            session_0 = et.Session(tmpdir / "session_0", name="session_0", metrics=[m0])
-            session_1 = et.Session(tmpdir / "session_1", name="session_1", metrics=[m1])
-            server = et.SessionServer([session_0, session_1], tmpdir / "server")
+        tmpdir = Path(tmpdir)
+        with open(tmpdir / "serialized" / "m0.csv") as f:
+            self.assertEqual(f.read(), "value\n0\n1\n2\n")
+        with open(tmpdir / "serialized" / "m1.csv") as f:
+            self.assertEqual(f.read(), "parameter,value\na,1\n")
 
-            for i in range(5):
+        m0 = NumericMetric("m0")
+        m0.extend(range(3))
+        m1 = ParameterSetMetric("m1", {"a": 1})
+        session = Session(
+            tmpdir / "aggregated",
+            metrics=[m0, m1],
+            plot_metrics=False,
+            aggregate_serialize=True,
+        )
+        with patch("experimenttools.sessions._write_all", partial_write):
+            with self.assertRaises(OSError):
+                session.update()
+        session.update()
+        session.close()
+        metrics = load_aggregated_metrics(tmpdir / "aggregated" / "serialized")
+        self.assertEqual(metrics["m0"], b"value\n0\n1\n2\n")
+        self.assertEqual(metrics["m1"], b"parameter,value\na,1\n")
+
+    def test_session_aggregate_serialize(self):
+        m0 = NumericMetric("m0")
+        m1 = TimedNumericMetric("m1")
+        m2 = ParameterSetMetric("m2", {"a": 1})
+
+        tmpdir = self.make_tmpdir()
+        session = Session(
+            tmpdir,
+            metrics=[m0, m1, m2],
+            plot_metrics=False,
+            aggregate_serialize=True,
+        )
+        for i in range(5):
+            m0(i)
+            m1(i * i)
+            session.update()
+        session.close()
+
+        tmpdir = Path(tmpdir)
+        self.assertFalse((tmpdir / "serialized" / "m0.csv").exists())
+        metrics = load_aggregated_metrics(tmpdir / "serialized")
+        self.assertEqual(metrics["m0"], b"value\n0\n1\n2\n3\n4\n")
+        m1_actual = _parse_values(metrics["m1"])
+        self.assertListEqual(m1_actual, [i * i for i in range(5)])
+        self.assertEqual(metrics["m2"], b"parameter,value\na,1\n")
+
+    def test_session_live_refresh(self):
+        m0 = NumericMetric("m0")
+
+        tmpdir = self.make_tmpdir()
+        tmpdir = Path(tmpdir)
+        session = Session(
+            tmpdir / "session", name="session", metrics=[m0], live_refresh=True
+        )
+        server = SessionServer([session], tmpdir / "server")
+        with open(session.output_dir / "index.html") as f:
+            page = f.read()
+
+        for i in range(5):
+            m0(i)
+        session.update()
+
+        with open(session.output_dir / "index.html") as f:
+            self.assertEqual(f.read(), page)
+        with open(session.output_dir / "index.json") as f:
+            item = json.load(f)
+        self.assertEqual(item["target_id"], "experimenttools-plot")
+        with open(server.output_dir / "session.json") as f:
+            self.assertEqual(json.load(f), item)
+
+        server.add_session(("session_copy", session.output_dir))
+        with open(server.output_dir / "session_copy.json") as f:
+            self.assertEqual(json.load(f), item)
+
+    def test_session_live_refresh_title(self):
+        m0 = NumericMetric("m0", 0)
+
+        tmpdir = self.make_tmpdir()
+        session = Session(tmpdir, name="a</title><b>&", metrics=[m0], live_refresh=True)
+        session.plot()
+        with open(session.output_dir / "index.html") as f:
+            page = f.read()
+        self.assertIn("<title>a&lt;/title&gt;&lt;b&gt;&amp;</title>", page)
+
+    def test_session_batch(self):
+        m0 = NumericMetric("m0")
+        m1 = NumericMetric("m1")
+        on_update = Mock()
+        callback = LambdaSessionCallback(on_update=on_update)
+
+        tmpdir = self.make_tmpdir()
+        session = Session(
+            tmpdir, metrics=[m0, m1], callbacks=[callback], plot_metrics=False
+        )
+        SessionManager(session, update_type="updates", update_freq=3).manage()
+        for i in range(3):
+            with session.batch():
                 m0(i)
                 m1(i * i)
+                self.assertEqual(on_update.call_count, i // 2)
+
+        # Updates only happen once both metrics have been recorded
+        tmpdir = Path(tmpdir)
+        self.assertEqual(on_update.call_count, 2)
+        m0_actual = _load_values(tmpdir / "serialized" / "m0.csv")
+        m1_actual = _load_values(tmpdir / "serialized" / "m1.csv")
+        self.assertListEqual(m0_actual, [0, 1, 2])
+        self.assertListEqual(m1_actual, [0, 1, 4])
+
+    def test_session_batch_error(self):
+        m0 = NumericMetric("m0")
+
+        tmpdir = self.make_tmpdir()
+        session = Session(tmpdir, metrics=[m0], plot_metrics=False)
+        with self.assertRaises(ValueError):
+            with session.batch():
+                m0(0)
+                session.update()
+                raise ValueError
+        # The update deferred by the failed batch is not run by the next one
+        with session.batch():
+            pass
+        self.assertFalse((Path(tmpdir) / "serialized" / "m0.csv").exists())
+
+    def test_session_server_concurrent_links(self):
+        tmpdir = self.make_tmpdir()
+        tmpdir = Path(tmpdir)
+        src_path = tmpdir / "index.html"
+        src_path.write_text("plots")
+        dest_path = tmpdir / "session.html"
+        errors = []
+
+        def link():
+            try:
+                for _ in range(50):
+                    _link(src_path, dest_path)
+            except OSError as e:
+                errors.append(e)
 
-            session_0.update()
-            session_1.update()
+        threads = [threading.Thread(target=link) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertListEqual(errors, [])
+        self.assertEqual(dest_path.read_text(), "plots")
+        # No temporary links are left behind
+        self.assertListEqual(
+            sorted(p.name for p in tmpdir.iterdir()), ["index.html", "session.html"]
+        )
+
+    def test_session_server_existing_outputs(self):
+        m0 = NumericMetric("m0", 0)
 
-            for session in [session_0, session_1]:
-                with open(session.output_dir / "index.html") as f:
-                    session_html = f.read()
-                with open(server.output_dir / f"{session.name}.html") as f:
-                    server_html = f.read()
-                self.assertEqual(session_html, server_html)
+        tmpdir = self.make_tmpdir()
+        tmpdir = Path(tmpdir)
+        session = Session(tmpdir / "session", name="session", metrics=[m0])
+        session.update()
+        with patch.object(session, "update") as update:
+            server = SessionServer([session], tmpdir / "server")
+        update.assert_not_called()
+        self.assertTrue((server.output_dir / "session.html").is_file())
+
+    def test_session_without_plots_skips_holoviews(self):
+        # Run in a fresh interpreter since other tests import holoviews
+        code = (
+            "import sys\n"
+            "import experimenttools as et\n"
+            "m0 = et.metrics.TimedNumericMetric('m0', 0)\n"
+            "session = et.Session(sys.argv[1], metrics=[m0], plot_metrics=False)\n"
+            "session.update()\n"
+            "assert 'holoviews' not in sys.modules\n"
+        )
+        tmpdir = self.make_tmpdir()
+        subprocess.run([sys.executable, "-c", code, tmpdir], check=True)
+
+    def test_session_without_holoviews(self):
+        # Run in a fresh interpreter where holoviews can not be imported
+        code = (
+            "import sys\n"
+            "sys.modules['holoviews'] = None\n"
+            "import experimenttools as et\n"
+            "m0 = et.metrics.NumericMetric('m0', 0)\n"
+            "session = et.Session(sys.argv[1], metrics=[m0], plot_metrics=False)\n"
+            "session.update()\n"
+            "try:\n"
+            "    et.Session(sys.argv[1], metrics=[m0]).update()\n"
+            "except ImportError as e:\n"
+            "    print(e)\n"
+        )
+        tmpdir = self.make_tmpdir()
+        result = subprocess.run(
+            [sys.executable, "-c", code, tmpdir],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        self.assertIn("pip install experimenttools[plot]", result.stdout)
+        m0_actual = _load_values(Path(tmpdir) / "serialized" / "m0.csv")
+        self.assertListEqual(m0_actual, [0])